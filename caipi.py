@@ -31,11 +31,12 @@ LEARNERS = {
             LinearLearner(*args, model='l1svm', **kwargs),
     'elastic': lambda *args, **kwargs: \
             LinearLearner(*args, model='elastic', **kwargs),
+    'sgd': lambda *args, **kwargs: \
+            LinearLearner(*args, model='sgd', **kwargs),
 }
 
 
 def _get_basename(args):
-    basename = '__'.join([args.problem, args.learner, args.strategy])
     fields = [
         ('k', args.n_folds),
         ('n', args.n_examples),
@@ -50,30 +51,37 @@ def _get_basename(args):
         ('K', args.kernel_width),
         ('R', args.lime_repeats),
         ('V', args.vectorizer),
+        ('r', args.refit_iters),
+        ('m', args.min_samples),
+        ('l', args.lime_stability),
         ('s', args.seed),
     ]
-    basename += '__' + '__'.join([name + '=' + str(value)
-                                  for name, value in fields])
+    basename = '__'.join([args.problem, args.learner, args.strategy] +
+                         ['{}={}'.format(name, value)
+                          for name, value in fields])
     return join('results', basename)
 
 
 def _subsample(problem, examples, prop, rng=None):
     rng = check_random_state(rng)
 
-    classes = sorted(set(problem.y))
+    classes = np.unique(problem.y)
     if 0 <= prop <= 1:
         n_sampled = int(round(len(examples) * prop))
         n_sampled_per_class = max(n_sampled // len(classes), 3)
     else:
         n_sampled_per_class = max(int(prop), 3)
 
+    examples = np.asarray(examples, dtype=np.intp)
+    examples_ys = problem.y[examples]
+
     sample = []
     for y in classes:
-        examples_y = np.array([i for i in examples if problem.y[i] == y])
+        examples_y = examples[examples_ys == y]
         pi = rng.permutation(len(examples_y))
-        sample.extend(examples_y[pi[:n_sampled_per_class]])
+        sample.extend(examples_y[pi[:n_sampled_per_class]].tolist())
 
-    return list(sample)
+    return sample
 
 
 def eval_passive(problem, args, rng=None):
@@ -83,9 +91,10 @@ def eval_passive(problem, args, rng=None):
     rng = check_random_state(rng)
     basename = _get_basename(args)
 
-    folds = StratifiedShuffleSplit(n_splits=args.n_folds, random_state=0) \
-                .split(problem.y, problem.y)
-    train_examples, test_examples = list(folds)[0]
+    # NOTE only the first split is used; it does not depend on n_splits
+    train_examples, test_examples = \
+        next(StratifiedShuffleSplit(n_splits=1, random_state=0)
+                 .split(problem.y, problem.y))
     eval_examples = _subsample(problem, test_examples,
                                args.prop_eval, rng=0)
     print('#train={} #test={} #eval={}'.format(
@@ -113,8 +122,7 @@ def eval_passive(problem, args, rng=None):
     print('perf on full training set =', perf)
 
     print('Computing corrections for {} examples...'.format(len(train_examples)))
-    X_test_tuples = {tuple(densify(problem.X[i]).ravel())
-                     for i in test_examples}
+    X_test_keys = row_keys(problem.X[test_examples])
 
     all_corrections = set()
     for j, i in enumerate(train_examples):
@@ -123,7 +131,7 @@ def eval_passive(problem, args, rng=None):
         pred_y = learner.predict(x)[0]
         pred_expl = problem.explain(learner, train_examples, i, pred_y)
         corrections = problem.query_corrections(i, pred_y, pred_expl,
-                                                X_test_tuples)
+                                                X_test_keys)
         all_corrections.update(corrections)
 
     print('all_corrections =', all_corrections)
@@ -156,6 +164,7 @@ def caipi(problem,
           max_iters=100,
           start_expl_at=-1,
           eval_iters=10,
+          refit_iters=1,
           basename=None,
           rng=None):
     rng = check_random_state(rng)
@@ -164,11 +173,14 @@ def caipi(problem,
           max_iters,
           len(train_examples), len(known_examples),
           len(test_examples), len(eval_examples)))
-    print('  #explainable in train', len(set(train_examples) & problem.explainable))
+    explainable_train = set(train_examples) & problem.explainable
+    print('  #explainable in train', len(explainable_train))
     print('  #explainable in eval', len(set(eval_examples) & problem.explainable))
 
-    X_test_tuples = {tuple(densify(problem.X[i]).ravel())
-                     for i in test_examples}
+    # NOTE updated incrementally rather than recomputed at every iteration
+    unknown_explainable = explainable_train - set(known_examples)
+
+    X_test_keys = row_keys(problem.X[test_examples])
 
     #learner.select_model(problem.X[train_examples],
     #                     problem.y[train_examples])
@@ -185,8 +197,18 @@ def caipi(problem,
 
     #learner.select_model(problem.X[known_examples],
     #                     problem.y[known_examples])
-    learner.fit(problem.X[known_examples],
-                problem.y[known_examples])
+    # NOTE index arrays are built once, rather than converting the lists
+    # every time the problem indexes X, y or Z with them
+    train_indices = np.asarray(train_examples, dtype=np.intp)
+    test_indices = np.asarray(test_examples, dtype=np.intp)
+    known_indices = np.empty(len(known_examples) + max_iters, dtype=np.intp)
+    n_known = len(known_examples)
+    known_indices[:n_known] = known_examples
+
+    # NOTE the training rows are kept as blocks and only stacked on full fits
+    X_known_blocks = [problem.X[known_indices[:n_known]]]
+    y_known_blocks = [problem.y[known_indices[:n_known]]]
+    learner.fit(X_known_blocks[0], y_known_blocks[0])
 
     corrections = set()
     perfs, instant_perfs, params = [], [], []
@@ -195,20 +217,19 @@ def caipi(problem,
         if len(known_examples) >= len(train_examples):
             break
 
-        unknown_examples = set(train_examples) - set(known_examples)
-        i = learner.select_query(problem, unknown_examples & problem.explainable)
-        assert i in train_examples and i not in known_examples
+        i = learner.select_query(problem, unknown_explainable)
+        assert i in unknown_explainable
         x = densify(problem.X[i])
 
         explain = 0 <= start_expl_at <= t
 
         pred_y = learner.predict(x)[0]
-        pred_expl = problem.explain(learner, known_examples, i, pred_y) \
-                    if explain else None
+        pred_expl = problem.explain(learner, known_indices[:n_known], i,
+                                    pred_y) if explain else None
 
         print('evaluating on query...')
         instant_perf = problem.eval(learner,
-                                    known_examples,
+                                    known_indices[:n_known],
                                     [i],
                                     [i],
                                     t=t,
@@ -217,28 +238,53 @@ def caipi(problem,
 
         true_y = problem.query_label(i)
         known_examples.append(i)
+        known_indices[n_known] = i
+        n_known += 1
+        unknown_explainable.discard(i)
 
+        new_corrections = set()
         if explain:
             new_corrections = problem.query_corrections(i, pred_y, pred_expl,
-                                                        X_test_tuples)
+                                                        X_test_keys)
             corrections.update(new_corrections)
 
-        learner.fit(problem.X[known_examples + list(corrections)],
-                    problem.y[known_examples + list(corrections)])
+        # NOTE take the query only now, query_corrections() may replace it
+        X_new, y_new = problem.X[[i]], problem.y[[i]]
+        X_known_blocks.append(X_new)
+        y_known_blocks.append(y_new)
+        if len(new_corrections):
+            new_corrections = sorted(new_corrections)
+            X_new = vstack([X_new, problem.X[new_corrections]])
+            y_new = hstack([y_new, problem.y[new_corrections]])
+
+        # NOTE incremental learners get a full refit every refit_iters
+        # iterations, and are only updated with the new examples otherwise
+        if (learner.supports_partial_fit() and
+            refit_iters > 1 and t % refit_iters != 0):
+            learner.partial_fit(X_new, y_new)
+        else:
+            # NOTE corrections go in set order, as liblinear is sensitive to
+            # the order of the rows
+            X_blocks, y_blocks = list(X_known_blocks), list(y_known_blocks)
+            if len(corrections):
+                corr_examples = list(corrections)
+                X_blocks.append(problem.X[corr_examples])
+                y_blocks.append(problem.y[corr_examples])
+            learner.fit(vstack(X_blocks), hstack(y_blocks))
         params.append(learner.get_params())
 
         do_eval = eval_iters > 0 and t % eval_iters == 0
 
         print('evaluating on test|eval...')
         perf = problem.eval(learner,
-                            train_examples,
-                            test_examples,
+                            train_indices,
+                            test_indices,
                             eval_examples if do_eval else None,
                             t=t, basename=basename)
         perf = tuple(list(perf) + list([len(corrections)]))
         perfs.append(perf)
 
-        params_for_print = np.round(learner.get_params(), decimals=1)
+        params_for_print = np.round(params[-1], decimals=1)
         print('{t:3d} : model = {params_for_print},  perfs on query = {instant_perf},  perfs on test = {perf}'.format(**locals()))
 
     return perfs, instant_perfs, params
@@ -279,6 +325,7 @@ def eval_interactive(problem, args, rng=None):
                   max_iters=args.max_iters,
                   start_expl_at=args.start_expl_at,
                   eval_iters=args.eval_iters,
+                  refit_iters=args.refit_iters,
                   basename=basename + '_fold={}'.format(k),
                   rng=rng)
         perfs.append(perf)
@@ -319,6 +366,9 @@ def main():
     group.add_argument('-e', '--eval-iters', type=int, default=10,
                        help='Interval for evaluating performance on the '
                        'evaluation set')
+    group.add_argument('--refit-iters', type=int, default=1,
+                       help='Interval for refitting incremental learners '
+                       'from scratch (e.g. sgd)')
     group.add_argument('--passive', action='store_true',
                        help='DEBUG: eval perfs using passive learning')
 
@@ -331,10 +381,20 @@ def main():
                        help='Number of LIME features to present the user')
     group.add_argument('-S', '--n-samples', type=int, default=5000,
                        help='Size of the LIME sampled dataset')
+    group.add_argument('--min-samples', type=int, default=None,
+                       help='If given, start LIME with this many samples and '
+                            'double them until it is stable, up to '
+                            '--n-samples (text only)')
+    group.add_argument('--lime-stability', type=float, default=0.8,
+                       help='Jaccard similarity between the words selected '
+                            'by two LIME runs for them to be deemed stable')
     group.add_argument('-K', '--kernel-width', type=float, default=0.75,
                        help='LIME kernel width')
     group.add_argument('-R', '--lime-repeats', type=int, default=1,
                        help='Number of times to re-run LIME')
+    group.add_argument('-j', '--lime-jobs', type=int, default=1,
+                       help='Number of processes used to score the LIME '
+                            'samples (-1 means all cores; text only)')
 
     group = parser.add_argument_group('Text')
     group.add_argument('--vectorizer', type=str, default=None,
@@ -354,6 +414,9 @@ def main():
                                      n_features=args.n_features,
                                      kernel_width=args.kernel_width,
                                      lime_repeats=args.lime_repeats,
+                                     lime_jobs=args.lime_jobs,
+                                     min_samples=args.min_samples,
+                                     lime_stability=args.lime_stability,
                                      vect_type=args.vectorizer,
                                      rng=rng)
 
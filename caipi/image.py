@@ -136,10 +136,13 @@ class ImageProblem(Problem):
         if eval_examples is None:
             return -1,
 
+        eval_examples = list(set(eval_examples) & self.explainable)
+        pred_ys = learner.predict(self.X[eval_examples]) \
+                  if len(eval_examples) else []
+
         perfs = []
-        for i in set(eval_examples) & self.explainable:
+        for i, pred_y in zip(eval_examples, pred_ys):
             true_y = self.y[i]
-            pred_y = learner.predict(densify(self.X[i]))[0]
 
             image = self.images[i]
             conf_mask = self._y_to_confounder(image, true_y)
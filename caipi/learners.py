@@ -24,6 +24,15 @@ class ActiveLearner:
         if self._decision_model is not self._prob_model:
             self._prob_model.fit(X, y)
 
+    def supports_partial_fit(self):
+        return (hasattr(self._decision_model, 'partial_fit') and
+                self._decision_model is self._prob_model)
+
+    def partial_fit(self, X, y):
+        """Updates an already fit learner using only the new examples."""
+        X = self._check_preprocessed(X)
+        self._decision_model.partial_fit(X, y)
+
     def get_params(self):
         try:
             return np.array(self._decision_model.coef_, copy=True)
@@ -87,6 +96,13 @@ class LinearLearner(ActiveLearner):
                                l1_ratio=0.15,
                                random_state=0)
 
+        elif model == 'sgd':
+            # logistic regression fit by SGD (supports partial_fit)
+            dm = pm = SGDClassifier(penalty='l2',
+                                    loss='log',
+                                    fit_intercept=False,
+                                    random_state=0)
+
         if pm is None:
             cv = StratifiedKFold(shuffle=True, random_state=0)
             pm = CalibratedClassifierCV(dm, method='sigmoid', cv=cv)
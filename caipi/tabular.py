@@ -11,7 +11,7 @@ from lime.lime_tabular import LimeTabularExplainer
 from matplotlib.patches import Circle, RegularPolygon
 from time import time
 
-from . import Problem, PipeStep, densify, vstack, hstack, setprfs
+from . import Problem, PipeStep, densify, row_key, vstack, hstack, setprfs
 
 
 _FEAT_NAME_REGEX = re.compile('[0-4],[0-4]')
@@ -121,12 +121,15 @@ class TabularProblem(Problem):
         if eval_examples is None:
             return -1, -1, -1
 
+        eval_examples = list(eval_examples)
+        pred_ys = learner.predict(self.X[eval_examples]) \
+                  if len(eval_examples) else []
+
         perfs = []
-        for i in eval_examples:
+        for i, pred_y in zip(eval_examples, pred_ys):
             true_y = self.y[i]
             true_expl = self.z_to_expl(self.Z[i])
 
-            pred_y = learner.predict(densify(self.X[i]))[0]
             pred_expl = self.explain(learner, known_examples, i, pred_y)
             if pred_expl is None:
                 print('Warning: skipping eval example')
@@ -253,7 +256,7 @@ class ToyProblem(TabularProblem):
             r, c, _ = self._parse_feat(feat)
             z_corr = np.array(z, copy=True)
             z_corr[3*r+c] = 1 - z_corr[3*r+c]
-            if self.z_to_y(z_corr) != true_y or tuple(z_corr) in X_test:
+            if self.z_to_y(z_corr) != true_y or row_key(z_corr) in X_test:
                 continue
             Z_new_corr.append(z_corr)
 
@@ -407,7 +410,7 @@ class ColorsProblem(TabularProblem):
                 z_corr[5*r+c] = value
                 if self.z_to_y(z_corr) != pred_y:
                     continue
-                if tuple(z_corr) in X_test:
+                if row_key(z_corr) in X_test:
                     continue
                 Z_corr.append(z_corr)
 
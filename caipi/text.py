@@ -1,10 +1,13 @@
 import numpy as np
 import re, blessings
+from os import cpu_count
 from time import time
+from multiprocessing import Pool
 from os.path import join
 from collections import defaultdict
-from scipy.sparse import csr_matrix
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from scipy.sparse import csr_matrix, hstack as sparse_hstack
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, \
+                                            HashingVectorizer, TfidfTransformer
 from sklearn.pipeline import make_pipeline
 from sklearn.linear_model import Ridge
 from sklearn.metrics import precision_recall_fscore_support as prfs
@@ -17,28 +20,88 @@ from . import Problem, load, densify, vstack, hstack
 
 _TERM = blessings.Terminal()
 
+# NOTE shared across explain() calls, so that we start the workers and send
+# them the (static) vectorizer and normalizer only once
+_POOL, _POOL_STEPS = None, None
+_WORKER_STEPS = None
+
+
+def _init_worker(steps):
+    global _WORKER_STEPS
+    _WORKER_STEPS = steps
+
+
+def _score_chunk(args):
+    model, docs = args
+    X = docs
+    for step in _WORKER_STEPS:
+        X = step.transform(X)
+    return model.predict_proba(X)
+
+
+def _get_pool(steps, n_jobs):
+    global _POOL, _POOL_STEPS
+    if (_POOL is None or len(steps) != len(_POOL_STEPS) or
+        any(a is not b for a, b in zip(steps, _POOL_STEPS))):
+        if _POOL is not None:
+            _POOL.terminate()
+        _POOL = Pool(n_jobs, initializer=_init_worker, initargs=(steps,))
+        _POOL_STEPS = steps
+    return _POOL
+
+
+class ParallelPipeline:
+    """Scores the LIME samples in chunks over a pool of worker processes."""
+    def __init__(self, steps, learner, n_jobs=-1):
+        self.steps = list(steps)
+        self.pipeline = make_pipeline(*steps, learner)
+        self.n_jobs = (cpu_count() or 1) if n_jobs < 0 else n_jobs
+
+        # NOTE the workers only get the probability model: the learner itself
+        # references the problem (also via its bound select_query), and once
+        # the steps are applied X is 2-D, so the problem is not needed
+        self.worker_model = learner._prob_model
+
+    def predict_proba(self, docs):
+        if self.n_jobs <= 1:
+            return self.pipeline.predict_proba(docs)
+        chunks = [(self.worker_model, [docs[j] for j in indices])
+                  for indices in np.array_split(np.arange(len(docs)),
+                                                self.n_jobs)
+                  if len(indices)]
+        pool = _get_pool(self.steps, self.n_jobs)
+        return np.vstack(pool.map(_score_chunk, chunks))
+
 
 class Normalizer:
     def fit(self, X, y=None):
         return self
 
     def transform(self, X, norms=None, return_norms=False, append_value=1):
-        new_X, ret_norms = [], []
-        try:
-            iterator = enumerate(X.todense())
-        except:
-            iterator = enumerate(X)
-        for i, x in iterator:
-            x = np.array(x).ravel()
-            norm = np.linalg.norm(x) if norms is None else norms[i]
+        # NOTE LIME feeds us thousands of samples, so instead of densifying
+        # all of X we go one dense row at a time; the norms and divisions are
+        # the same as those computed on the fully dense X
+        X = csr_matrix(X)
+        new_X = X.copy()
+        new_X.data = np.array(new_X.data, dtype=np.result_type(X.dtype, 1.0))
+        ret_norms, row = [], np.zeros(X.shape[1], dtype=X.dtype)
+        for i in range(X.shape[0]):
+            start, stop = X.indptr[i], X.indptr[i + 1]
+            if norms is None:
+                row[X.indices[start:stop]] = X.data[start:stop]
+                norm = np.linalg.norm(row)
+                row[X.indices[start:stop]] = 0
+            else:
+                norm = norms[i]
             norm = max(1e-16, norm)
             ret_norms.append(norm)
-            new_X.append(x.ravel() / norm)
-        new_X = np.array(new_X)
+            new_X.data[start:stop] = X.data[start:stop] / norm
         if append_value is not None:
-            new_X = np.hstack([new_X,
-                               append_value * np.ones((new_X.shape[0], 1))])
-        new_X = csr_matrix(np.array(new_X))
+            new_X = sparse_hstack([new_X,
+                                   append_value * np.ones((new_X.shape[0], 1))],
+                                  format='csr')
+        new_X.eliminate_zeros()
+        new_X.sort_indices()
         if return_norms:
             return new_X, ret_norms
         return new_X
@@ -78,6 +141,12 @@ class TextProblem(Problem):
         self.processed_docs = kwargs.pop('processed_docs')
         self.explanations = kwargs.pop('explanations')
         self.lime_repeats = kwargs.pop('lime_repeats', 1)
+        self.lime_jobs = kwargs.pop('lime_jobs', 1)
+        self.min_samples = kwargs.pop('min_samples', None)
+        self.lime_stability = kwargs.pop('lime_stability', 0.8)
+        if self.min_samples is not None and self.min_samples < 1:
+            raise ValueError('min_samples must be positive, got {}'.format(
+                                 self.min_samples))
         n_examples = kwargs.pop('n_examples', None)
         self.corr_type = kwargs.pop('corr_type', 'replace-expl') or 'replace-expl'
         self.vect_type = kwargs.pop('vect_type', 'glove')
@@ -98,6 +167,14 @@ class TextProblem(Problem):
         elif self.vect_type == 'tfidf':
             self.vectorizer = TfidfVectorizer(lowercase=False) \
                                   .fit(self.processed_docs)
+        elif self.vect_type == 'hashing':
+            # NOTE same as tfidf, but without storing the vocabulary
+            hasher = HashingVectorizer(lowercase=False,
+                                       n_features=2**18,
+                                       alternate_sign=False,
+                                       norm=None)
+            tfidf = TfidfTransformer().fit(hasher.transform(self.processed_docs))
+            self.vectorizer = make_pipeline(hasher, tfidf)
         elif self.vect_type == 'glove':
             path = join('data', 'word2vec_glove.6B.300d.bin')
             self.vectorizer = Word2VecVectorizer(path)
@@ -124,6 +201,34 @@ class TextProblem(Problem):
         selected_words = {words[i] for i in np.where(true_mask)[0]}
         return [(word, self.y[i]) for word in selected_words]
 
+    def _run_lime(self, explainer, pipeline, i, n_features, n_samples):
+        local_model = Ridge(alpha=1, fit_intercept=True, random_state=0)
+        return explainer.explain_instance(self.processed_docs[i],
+                                          pipeline.predict_proba,
+                                          model_regressor=local_model,
+                                          num_features=n_features,
+                                          num_samples=n_samples)
+
+    def _find_n_samples(self, explainer, pipeline, i, n_features):
+        """Doubles the number of LIME samples, starting from min_samples,
+        until two runs of LIME select (almost) the same words or n_samples
+        is reached."""
+        n_samples = min(self.min_samples, self.n_samples)
+        while True:
+            expls = [self._run_lime(explainer, pipeline, i, n_features,
+                                    n_samples)
+                     for _ in range(2)]
+            words = [{word for word, _ in expl.as_list()} for expl in expls]
+            union = words[0] | words[1]
+            jaccard = (len(words[0] & words[1]) / len(union)
+                       if len(union) else 1.0)
+            print('  LIME stability with {} samples = {:3.2f}'.format(
+                      n_samples, jaccard))
+            # NOTE the last check runs at the cap, so its runs are kept too
+            if jaccard >= self.lime_stability or n_samples >= self.n_samples:
+                return n_samples, expls
+            n_samples = min(2 * n_samples, self.n_samples)
+
     def explain(self, learner, known_examples, i, y_pred):
         explainer = LimeTextExplainer(class_names=self.class_names)
 
@@ -134,21 +239,25 @@ class TextProblem(Problem):
             true_expl = self._masks_to_expl(i)
             n_features = max(len(true_expl), 1) # XXX FIXME XXX
 
-        pipeline = make_pipeline(self.vectorizer, self.normalizer, learner)
+        pipeline = ParallelPipeline([self.vectorizer, self.normalizer], learner,
+                                    n_jobs=self.lime_jobs)
 
-        counts = defaultdict(int)
-        for r in range(self.lime_repeats):
+        # NOTE the runs used to check stability count as repeats
+        n_samples, expls = self.n_samples, []
+        if self.min_samples is not None:
+            n_samples, expls = self._find_n_samples(explainer, pipeline, i,
+                                                    n_features)
+        expls = expls[:self.lime_repeats]
 
+        for r in range(len(expls), self.lime_repeats):
             t = time()
-            local_model = Ridge(alpha=1, fit_intercept=True, random_state=0)
-            expl = explainer.explain_instance(self.processed_docs[i],
-                                              pipeline.predict_proba,
-                                              model_regressor=local_model,
-                                              num_features=n_features,
-                                              num_samples=self.n_samples)
+            expls.append(self._run_lime(explainer, pipeline, i, n_features,
+                                        n_samples))
             print('  LIME {}/{} took {:3.2f}s'.format(r + 1, self.lime_repeats,
                                                  time() - t))
 
+        counts = defaultdict(int)
+        for expl in expls:
             for word, coeff in expl.as_list():
                 counts[(word, int(np.sign(coeff)))] += 1
 
@@ -242,12 +351,15 @@ class TextProblem(Problem):
         if eval_examples is None:
             return -1, -1, -1
 
+        eval_examples = list(set(eval_examples) & self.explainable)
+        pred_ys = learner.predict(self.X[eval_examples]) \
+                  if len(eval_examples) else []
+
         perfs = []
-        for i in set(eval_examples) & self.explainable:
+        for i, pred_y in zip(eval_examples, pred_ys):
             true_y = self.y[i]
             true_expl = self._masks_to_expl(i)
 
-            pred_y = learner.predict(densify(self.X[i]))[0]
             pred_expl = self.explain(learner, known_examples, i, pred_y)
 
             # NOTE here we don't care if the coefficients are wrong, since
@@ -286,15 +398,16 @@ class TextProblem(Problem):
 
     @staticmethod
     def _highlight_words(text, expl):
-        for word, sign in expl:
-            color = _TERM.green if sign >= 0 else _TERM.red
-            colored_word = color + word + _TERM.normal
-            matches = list(re.compile(word).finditer(text))
-            matches.reverse()
-            for match in matches:
-                start = match.start()
-                text = text[:start] + colored_word + text[start+len(word):]
-        return text
+        colors = {word: _TERM.green if sign >= 0 else _TERM.red
+                  for word, sign in expl}
+        if not len(colors):
+            return text
+        # NOTE longer words first, so that they win over their substrings
+        words = sorted(colors, key=len, reverse=True)
+        regex = re.compile('|'.join(re.escape(word) for word in words))
+        return regex.sub(lambda match: colors[match.group(0)] +
+                                       match.group(0) + _TERM.normal,
+                         text)
 
     def save_expl(self, path, i, pred_y, expl):
         with open(path, 'wt') as fp:
@@ -1,4 +1,5 @@
 import pickle
+from hashlib import md5
 import numpy as np
 import scipy as sp
 
@@ -9,6 +10,8 @@ def load(path, **kwargs):
 
 
 def dump(path, what, **kwargs):
+    # NOTE protocol 5 (Python 3.8+) writes numpy buffers without copying them
+    kwargs.setdefault('protocol', pickle.HIGHEST_PROTOCOL)
     with open(path, 'wb') as fp:
         pickle.dump(what, fp, **kwargs)
 
@@ -26,6 +29,30 @@ def densify(x):
     return x
 
 
+def _fingerprint(x):
+    # NOTE not meant to be secure, md5 is just a fast 128-bit hash
+    return md5(x.tobytes()).digest()
+
+
+def row_key(x):
+    """Turns a single example into a 128-bit fingerprint."""
+    return _fingerprint(np.asarray(densify(x), dtype=np.float64).ravel())
+
+
+def row_keys(X, max_chunk_values=2**22):
+    """Turns all rows of X (dense or sparse) into a set of fingerprints."""
+    keys = set()
+    # NOTE densify a few rows at a time, a dense TF-IDF block can be huge
+    n_values = int(np.prod(X.shape[1:]))
+    chunk_size = max(1, max_chunk_values // max(1, n_values))
+    for start in range(0, X.shape[0], chunk_size):
+        chunk = X[start:start + chunk_size]
+        chunk = chunk.toarray() if sp.sparse.issparse(chunk) else np.asarray(chunk)
+        chunk = chunk.reshape((chunk.shape[0], -1)).astype(np.float64, copy=False)
+        keys.update(_fingerprint(x) for x in chunk)
+    return keys
+
+
 def _stack(arrays, d_stack, s_stack):
     arrays = [a for a in arrays if a is not None]
     if len(arrays) == 0:
@@ -37,7 +64,30 @@ def _stack(arrays, d_stack, s_stack):
     else:
         return d_stack(arrays)
 
-vstack = lambda arrays: _stack(arrays, np.vstack, sp.sparse.vstack)
+
+def _vstack_csr(arrays):
+    """Stacks CSR matrices by concatenating their buffers, which skips the
+    COO round-trip of scipy.sparse.vstack."""
+    if (not all(isinstance(a, sp.sparse.csr_matrix) for a in arrays) or
+        len({a.shape[1] for a in arrays}) != 1):
+        return sp.sparse.vstack(arrays, format='csr')
+
+    data, indices, indptr, nnz = [], [], [np.zeros(1, dtype=np.int64)], 0
+    for a in arrays:
+        start, stop = a.indptr[0], a.indptr[-1]
+        data.append(a.data[start:stop])
+        indices.append(a.indices[start:stop])
+        indptr.append(a.indptr[1:].astype(np.int64) - start + nnz)
+        nnz += stop - start
+
+    n_rows = sum(a.shape[0] for a in arrays)
+    return sp.sparse.csr_matrix((np.concatenate(data),
+                                 np.concatenate(indices),
+                                 np.concatenate(indptr)),
+                                shape=(n_rows, arrays[0].shape[1]))
+
+
+vstack = lambda arrays: _stack(arrays, np.vstack, _vstack_csr)
 hstack = lambda arrays: _stack(arrays, np.hstack, sp.sparse.hstack)
 
 
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import re
-import pickle
 import numpy as np
 import spacy
 from os import listdir
@@ -144,5 +143,4 @@ dataset = {
     'explanations': rats,
 }
 
-with open(join('data', 'review_polarity_rationales.pickle'), 'wb') as fp:
-    pickle.dump(dataset, fp)
+dump(join('data', 'review_polarity_rationales.pickle'), dataset)